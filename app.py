@@ -1,8 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 from supabase import create_client, Client
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURAÇÃO DA PÁGINA ---
 st.set_page_config(
@@ -33,41 +35,138 @@ def init_connection():
 supabase = init_connection()
 
 # --- CARREGAMENTO DE DADOS ---
-@st.cache_data(ttl=600) # Atualiza o cache a cada 10 minutos
-def get_data():
-    if not supabase: return None, None, None
-    
-    # Busca Jogadores
-    res_players = supabase.table("players").select("*").order("name").execute()
+# Duas funções separadas para o formulário não pagar o fetch das 10k linhas de
+# histórico a cada tecla digitada — cada aba busca só o que usa.
+# Cache de 10 minutos; persist='disk' sobrevive aos restarts de worker do
+# Streamlit Cloud (ler do disco é bem mais barato que refazer o fetch).
+@st.cache_data(ttl=600, persist="disk", show_spinner=False)
+def get_players_decks():
+    if not supabase: return None, None, {}, {}
+
+    # As duas buscas são independentes — disparadas em paralelo, a latência total
+    # vira a do maior round-trip em vez da soma.
+    # Cada select pede só as colunas usadas: menos bytes na rede e frames mais estreitos.
+    def _players():
+        return supabase.table("players").select("player_id,name").order("name").execute()
+
+    def _decks():
+        # Decks trazem o nome do dono junto para facilitar
+        # (join manual no pandas logo abaixo)
+        return supabase.table("decks").select("deck_id,player_id,deck_name").execute()
+
+    with ThreadPoolExecutor(2) as ex:
+        fut_p, fut_d = ex.submit(_players), ex.submit(_decks)
+        res_players, res_decks = fut_p.result(), fut_d.result()
+
     df_players = pd.DataFrame(res_players.data)
-    
-    # Busca Decks (Trazendo o nome do dono junto para facilitar)
-    # Precisamos fazer um join manual ou view, mas aqui vamos puxar tudo e mapar no pandas
-    res_decks = supabase.table("decks").select("*").execute()
     df_decks = pd.DataFrame(res_decks.data)
-    
-    # Busca Histórico (View)
-    res_history = supabase.table("view_full_history").select("*").order("date", desc=True).limit(10000).execute()
-    df_history = pd.DataFrame(res_history.data)
-    
-    return df_players, df_decks, df_history
 
-df_players, df_decks, df_history = get_data()
+    if 'name' in df_players.columns:
+        df_players['name'] = df_players['name'].astype('category')
+
+    # Prepara lista de decks formatada: "Nome do Deck (Dono)"
+    # Feito aqui dentro do cache para não reexecutar a cada rerun do Streamlit
+    if not df_decks.empty and not df_players.empty:
+        player_map = dict(zip(df_players['player_id'], df_players['name']))
+        df_decks['owner_name'] = df_decks['player_id'].map(player_map)
+        df_decks['display_name'] = df_decks['deck_name'] + " (" + df_decks['owner_name'].astype(str) + ")"
+        df_decks = df_decks.sort_values('display_name')
+        # Mapas para lookup O(1) no formulário (em vez de varrer o DataFrame por participante)
+        name_to_pid = dict(zip(df_players['name'].astype(str), df_players['player_id']))
+        disp_to_did = dict(zip(df_decks['display_name'].astype(str), df_decks['deck_id']))
+    else:
+        name_to_pid, disp_to_did = {}, {}
+
+    return df_players, df_decks, name_to_pid, disp_to_did
+
+@st.cache_data(ttl=600, persist="disk", show_spinner=False)
+def get_history():
+    if not supabase: return None
+
+    res_history = supabase.table("view_full_history").select(
+        "match_id,date,player_name,deck_name,is_winner,turn_eliminated,eliminated_by,color_identity"
+    ).order("date", desc=True).range(0, 9999).execute()
+    df_history = pd.DataFrame.from_records(res_history.data)
+
+    # Backend Arrow: st.dataframe serializa via Arrow, então colunas já em Arrow
+    # (em vez de object) dispensam a conversão célula a célula na renderização
+    df_history = df_history.convert_dtypes(dtype_backend='pyarrow')
+
+    # Dtypes explícitos logo na construção: a inferência da lista de dicts deixaria
+    # ints/bools como object, empurrando os groupby/sum para o caminho lento do pandas.
+    # As colunas de texto de baixa cardinalidade viram category (códigos inteiros).
+    hist_dtypes = {'match_id': 'int32', 'is_winner': 'bool', 'turn_eliminated': 'Int16',
+                   'player_name': 'category', 'deck_name': 'category', 'color_identity': 'category'}
+    for c, t in hist_dtypes.items():
+        if c in df_history.columns:
+            df_history[c] = df_history[c].astype(t)
+
+    # Converte a data uma única vez (Streamlit reexecuta o script a cada interação,
+    # então parsear aqui dentro do cache evita refazer isso em todo rerun)
+    if 'date' in df_history.columns:
+        df_history['date'] = pd.to_datetime(df_history['date'], format='ISO8601', cache=True)
+        df_history['year'] = df_history['date'].dt.year.astype('int16')
+
+    return df_history
+
+# Agregações do Dashboard direto no Postgres (ver sql/analytics.sql).
+# Um GROUP BY no banco devolve um JSON pequeno em vez de 10k linhas para agregar aqui.
+@st.cache_data(ttl=600)
+def get_player_winrate(ano):
+    try:
+        res = supabase.rpc("vw_player_winrate", {"p_year": ano}).execute()
+        return pd.DataFrame(res.data)
+    except Exception:
+        return None  # função ainda não criada no banco: cai no cálculo em pandas
+
+@st.cache_data(ttl=600)
+def get_color_counts(ano):
+    try:
+        res = supabase.rpc("vw_color_counts", {"p_year": ano}).execute()
+        return pd.DataFrame(res.data)
+    except Exception:
+        return None
+
+# Array de anos cacheado para o filtro do Dashboard trabalhar direto em numpy
+@st.cache_data(show_spinner=False)
+def get_year_array(df):
+    return df['year'].to_numpy()
+
+# Exibição do Histórico: a projeção + rename roda uma vez por refresh de dados,
+# e o filtro de busca só recomputa quando o texto digitado muda
+@st.cache_data(show_spinner=False)
+def get_history_display(df):
+    cols_show = ['match_id', 'date', 'player_name', 'deck_name', 'is_winner', 'turn_eliminated', 'eliminated_by']
+    return df[cols_show].rename(columns={
+        'match_id': 'ID', 'date': 'Data', 'player_name': 'Jogador',
+        'deck_name': 'Deck', 'is_winner': 'Venceu?',
+        'turn_eliminated': 'Turno', 'eliminated_by': 'Eliminado Por'
+    })
+
+@st.cache_data(show_spinner=False)
+def search_history(df_show, search):
+    if not search:
+        return df_show
+    # Busca coluna a coluna, substring pura — sem regex e sem astype global
+    mask = np.zeros(len(df_show), dtype=bool)
+    for c in df_show.columns:
+        col = df_show[c]
+        if col.dtype != object:
+            col = col.astype(str)
+        mask |= col.str.contains(search, case=False, regex=False, na=False).to_numpy()
+    return df_show.loc[mask]
 
-# Prepara lista de decks formatada: "Nome do Deck (Dono)"
-# Isso ajuda a selecionar o deck certo sem precisar de filtros complexos no formulário
-if not df_decks.empty and not df_players.empty:
-    # Cria mapa de ID -> Nome do Jogador
-    player_map = dict(zip(df_players['player_id'], df_players['name']))
-    df_decks['owner_name'] = df_decks['player_id'].map(player_map)
-    df_decks['display_name'] = df_decks['deck_name'] + " (" + df_decks['owner_name'].astype(str) + ")"
-    df_decks = df_decks.sort_values('display_name')
+df_players, df_decks, name_to_pid, disp_to_did = get_players_decks()
 
 # --- INTERFACE ---
 st.title("🐉 Commander Tracker")
 
 menu = st.sidebar.radio("Navegação", ["📊 Dashboard", "📜 Histórico", "➕ Registrar Partida"])
 
+# O histórico só é carregado nas abas que o usam — o formulário fica de fora
+if menu != "➕ Registrar Partida":
+    df_history = get_history()
+
 # ==============================================================================
 # ABA 1: DASHBOARD
 # ==============================================================================
@@ -80,14 +179,17 @@ if menu == "📊 Dashboard":
         # Filtros
         col1, col2 = st.columns(2)
         with col1:
-            if 'date' in df_history.columns:
-                anos = sorted(pd.to_datetime(df_history['date']).dt.year.unique(), reverse=True)
+            if 'year' in df_history.columns:
+                anos = sorted(df_history['year'].unique(), reverse=True)
                 ano_sel = st.selectbox("📅 Filtrar por Ano", ["Todos"] + list(anos))
-        
-        # Aplica Filtro
-        df_filtered = df_history.copy()
-        if ano_sel != "Todos":
-            df_filtered = df_filtered[pd.to_datetime(df_filtered['date']).dt.year == ano_sel]
+
+        # Aplica Filtro (sem .copy(): nada abaixo muta o frame, só filtra e agrupa).
+        # take sobre os índices calculados em numpy evita a máscara booleana do pandas
+        if ano_sel == "Todos":
+            df_filtered = df_history
+        else:
+            year_arr = get_year_array(df_history)
+            df_filtered = df_history.take(np.flatnonzero(year_arr == ano_sel))
 
         # KPIs
         total_jogos = df_filtered['match_id'].nunique()
@@ -104,19 +206,25 @@ if menu == "📊 Dashboard":
         # Gráficos
         c1, c2 = st.columns([1, 1])
         
+        ano_rpc = None if ano_sel == "Todos" else int(ano_sel)
+
         with c1:
             st.subheader("🏆 Top Win Rate (%)")
             st.caption("Mínimo de 5 jogos no período")
-            
-            stats = df_filtered.groupby('player_name').agg(
-                jogos=('match_id', 'nunique'),
-                vitorias=('is_winner', 'sum')
-            ).reset_index()
-            
-            stats = stats[stats['jogos'] >= 5]
-            stats['win_rate'] = (stats['vitorias'] / stats['jogos']) * 100
-            stats = stats.sort_values('win_rate', ascending=False).head(10)
-            
+
+            stats = get_player_winrate(ano_rpc)
+            if stats is None or stats.empty:
+                # drop_duplicates + size evita o nunique por grupo (caminho lento do pandas);
+                # sort=False dispensa a ordenação das chaves e nlargest faz ordenação parcial
+                played = (df_filtered[['player_name', 'match_id']]
+                          .drop_duplicates().groupby('player_name', sort=False).size().rename('jogos'))
+                wins = df_filtered.groupby('player_name', sort=False)['is_winner'].sum().rename('vitorias')
+                stats = pd.concat([played, wins], axis=1).reset_index()
+
+                stats = stats[stats['jogos'] >= 5]
+                stats['win_rate'] = stats['vitorias'].to_numpy() / stats['jogos'].to_numpy() * 100.0
+                stats = stats.nlargest(10, 'win_rate')
+
             fig_wr = px.bar(stats, x='win_rate', y='player_name', orientation='h',
                             text_auto='.1f', color='win_rate', color_continuous_scale='RdYlGn')
             fig_wr.update_layout(yaxis={'categoryorder':'total ascending'}, xaxis_title="Win Rate %")
@@ -124,8 +232,17 @@ if menu == "📊 Dashboard":
             
         with c2:
             st.subheader("🎨 Cores Mais Jogadas")
-            if 'color_identity' in df_filtered.columns:
-                cores = df_filtered['color_identity'].replace('', 'Incolor').value_counts().head(10).reset_index()
+            cores = get_color_counts(ano_rpc)
+            if (cores is None or cores.empty) and 'color_identity' in df_filtered.columns:
+                ci = df_filtered['color_identity']
+                if ci.dtype.name == 'category':
+                    # renomeia a categoria vazia in-place; value_counts vira um
+                    # bincount sobre os códigos, sem alocar uma Series substituída
+                    ci = ci.cat.rename_categories(lambda x: 'Incolor' if x == '' else x)
+                else:
+                    ci = ci.mask(ci.eq(''), 'Incolor')
+                cores = ci.value_counts().head(10).rename_axis('Identity').reset_index(name='Count')
+            if cores is not None and not cores.empty:
                 cores.columns = ['Identity', 'Count']
                 fig_pie = px.pie(cores, values='Count', names='Identity', hole=0.4)
                 st.plotly_chart(fig_pie, use_container_width=True)
@@ -137,24 +254,16 @@ elif menu == "📜 Histórico":
     st.header("Histórico de Partidas")
     
     search = st.text_input("🔍 Buscar (Jogador, Deck ou Data)", placeholder="Ex: Atraxa")
-    
-    view_df = df_history.copy()
-    
-    # Filtro de busca simples
-    if search:
-        mask = view_df.astype(str).apply(lambda x: x.str.contains(search, case=False)).any(axis=1)
-        view_df = view_df[mask]
-    
-    # Seleção de colunas para ficar bonito
-    cols_show = ['match_id', 'date', 'player_name', 'deck_name', 'is_winner', 'turn_eliminated', 'eliminated_by']
-    # Renomear para português na exibição
-    view_df_show = view_df[cols_show].rename(columns={
-        'match_id': 'ID', 'date': 'Data', 'player_name': 'Jogador', 
-        'deck_name': 'Deck', 'is_winner': 'Venceu?', 
-        'turn_eliminated': 'Turno', 'eliminated_by': 'Eliminado Por'
-    })
-    
-    st.dataframe(view_df_show, use_container_width=True, hide_index=True, height=600)
+
+    view_df_show = search_history(get_history_display(df_history), search)
+
+    # Paginação no servidor: envia só uma página ao navegador em vez do frame inteiro
+    page_size = 100
+    n_pages = max(1, -(-len(view_df_show) // page_size))
+    page = st.number_input("Página", min_value=1, max_value=n_pages, value=1) - 1
+    st.caption(f"{len(view_df_show)} registros — página {page + 1} de {n_pages}")
+    st.dataframe(view_df_show.iloc[page * page_size:(page + 1) * page_size],
+                 use_container_width=True, hide_index=True)
 
 # ==============================================================================
 # ABA 3: REGISTRO (COM SENHA)
@@ -212,38 +321,43 @@ elif menu == "➕ Registrar Partida":
                     st.error("❌ Selecione pelo menos 2 jogadores e seus decks.")
                 else:
                     try:
-                        # 2. Inserir Partida (Matches)
-                        # O ID será gerado automaticamente pelo banco (auto-incremento)
-                        dados_partida = {
-                            "date": str(data_jogo),
-                            "notes": notas
-                        }
-                        res_match = supabase.table("matches").insert(dados_partida).execute()
-                        
-                        # Recupera o ID gerado
-                        novo_match_id = res_match.data[0]['match_id']
-                        
-                        # 3. Preparar Participantes
-                        dados_participantes = []
-                        ranking_count = 1
-                        
-                        for p in validos:
-                            # Recuperar IDs reais baseado nos nomes
-                            pid = df_players[df_players['name'] == p['nome']]['player_id'].values[0]
-                            did = df_decks[df_decks['display_name'] == p['deck_display']]['deck_id'].values[0]
-                            
-                            dados_participantes.append({
-                                "match_id": novo_match_id,
-                                "player_id": pid,
-                                "deck_id": did,
-                                "is_winner": p['venceu'],
-                                "turn_eliminated": int(p['turno']),
-                                "rank": 1 if p['venceu'] else 0 # Lógica simples de rank
-                            })
-                            
-                        # 4. Inserir Participantes
-                        supabase.table("match_participants").insert(dados_participantes).execute()
-                        
+                        # 2. Preparar Participantes — construção em bloco: os IDs saem
+                        # dos mapas de lookup e o caminho continua vetorizado se a
+                        # mesa crescer para 6+ jogadores
+                        names = np.array([p['nome'] for p in validos])
+                        disps = np.array([p['deck_display'] for p in validos])
+                        pids = np.vectorize(name_to_pid.__getitem__)(names)
+                        dids = np.vectorize(disp_to_did.__getitem__)(disps)
+                        wins = np.array([p['venceu'] for p in validos], bool)
+                        turns = np.array([p['turno'] for p in validos], int)
+                        dados_participantes = pd.DataFrame({
+                            "player_id": pids,
+                            "deck_id": dids,
+                            "is_winner": wins,
+                            "turn_eliminated": turns,
+                            "rank": wins.astype(int) # Lógica simples de rank
+                        }).to_dict('records')
+
+                        # 3. Inserir partida + participantes em uma única transação
+                        # (ver sql/register_match.sql): um round-trip só e sem risco
+                        # de partida órfã se o insert dos participantes falhar
+                        try:
+                            novo_match_id = supabase.rpc("register_match", {
+                                "p_date": str(data_jogo),
+                                "p_notes": notas,
+                                "p_parts": dados_participantes,
+                            }).execute().data
+                        except Exception:
+                            # Função ainda não criada no banco: dois inserts sequenciais
+                            res_match = supabase.table("matches").insert({
+                                "date": str(data_jogo),
+                                "notes": notas
+                            }).execute()
+                            novo_match_id = res_match.data[0]['match_id']
+                            for d in dados_participantes:
+                                d["match_id"] = novo_match_id
+                            supabase.table("match_participants").insert(dados_participantes).execute()
+
                         st.balloons()
                         st.success(f"✅ Partida registrada com sucesso! ID: {novo_match_id}")
                         st.cache_data.clear() # Limpa cache para atualizar gráficos
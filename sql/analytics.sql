@@ -0,0 +1,37 @@
+-- Funções de agregação usadas pelo Dashboard.
+-- Rode este arquivo no SQL Editor do Supabase; o app chama via supabase.rpc()
+-- e cai de volta no cálculo em pandas se as funções ainda não existirem.
+
+-- Win rate por jogador (mínimo de 5 jogos), opcionalmente filtrado por ano.
+create or replace function vw_player_winrate(p_year int default null)
+returns table (player_name text, jogos bigint, vitorias bigint, win_rate numeric)
+language sql stable as $$
+    select p.name as player_name,
+           count(distinct mp.match_id) as jogos,
+           count(*) filter (where mp.is_winner) as vitorias,
+           round(count(*) filter (where mp.is_winner)::numeric
+                 / count(distinct mp.match_id) * 100, 1) as win_rate
+    from match_participants mp
+    join matches m on m.match_id = mp.match_id
+    join players p on p.player_id = mp.player_id
+    where p_year is null or extract(year from m.date)::int = p_year
+    group by p.name
+    having count(distinct mp.match_id) >= 5
+    order by win_rate desc
+    limit 10;
+$$;
+
+-- Contagem de identidades de cor jogadas, opcionalmente filtrada por ano.
+create or replace function vw_color_counts(p_year int default null)
+returns table (identity text, count bigint)
+language sql stable as $$
+    select coalesce(nullif(d.color_identity, ''), 'Incolor') as identity,
+           count(*) as count
+    from match_participants mp
+    join matches m on m.match_id = mp.match_id
+    join decks d on d.deck_id = mp.deck_id
+    where p_year is null or extract(year from m.date)::int = p_year
+    group by 1
+    order by count desc
+    limit 10;
+$$;
@@ -0,0 +1,24 @@
+-- Registro atômico de partida + participantes em uma única chamada RPC.
+-- Rode este arquivo no SQL Editor do Supabase; enquanto a função não existir,
+-- o app cai de volta nos dois inserts sequenciais.
+
+create or replace function register_match(p_date date, p_notes text, p_parts jsonb)
+returns int
+language plpgsql as $$
+declare new_id int;
+begin
+    insert into matches(date, notes) values (p_date, p_notes)
+    returning match_id into new_id;
+
+    insert into match_participants(match_id, player_id, deck_id, is_winner, turn_eliminated, rank)
+    select new_id,
+           (e->>'player_id')::int,
+           (e->>'deck_id')::int,
+           (e->>'is_winner')::bool,
+           (e->>'turn_eliminated')::int,
+           (e->>'rank')::int
+    from jsonb_array_elements(p_parts) e;
+
+    return new_id;
+end;
+$$;